@@ -1,5 +1,8 @@
+import asyncio
 import logging
 import os
+import signal
+from contextlib import asynccontextmanager
 from pathlib import Path
 
 from fastapi import FastAPI, HTTPException, Request
@@ -9,7 +12,8 @@ from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 
-from .shelly_controller import ShellyController, ControlMode
+from .monitor_wan1 import create_omada_session, monitor_loop
+from .shelly_controller import ShellyController, ControlMode, create_shelly_session
 
 logging.basicConfig(
     level=logging.INFO,
@@ -23,14 +27,55 @@ API_TOKEN = os.getenv('API_TOKEN')
 if not API_TOKEN:
     raise ValueError('API_TOKEN environment variable must be set')
 
+# Seconds to let the monitor finish its current check on shutdown
+MONITOR_SHUTDOWN_TIMEOUT = 5
+
 # Initialize rate limiter (10 requests per hour for all endpoints)
 limiter = Limiter(key_func=get_remote_address, default_limits=["10/hour"])
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run the WAN1 monitor as a background task on the app's event loop"""
+    app.state.shelly_session = create_shelly_session()
+    app.state.omada_session = create_omada_session()
+    stop_event = asyncio.Event()
+    monitor_task = asyncio.create_task(monitor_loop(
+        controller,
+        app.state.shelly_session,
+        app.state.omada_session,
+        stop_event
+    ))
+    monitor_task.add_done_callback(_on_monitor_done)
+    try:
+        yield
+    finally:
+        stop_event.set()
+        if not monitor_task.done():
+            # A check with retries can take far longer than Docker's stop grace
+            # period, so give the current tick a bounded wait before cancelling it
+            try:
+                await asyncio.wait_for(monitor_task, MONITOR_SHUTDOWN_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning("Monitor did not stop in time, cancelled")
+        await app.state.shelly_session.close()
+        await app.state.omada_session.close()
+
+
+def _on_monitor_done(task: asyncio.Task) -> None:
+    """Stop the server if the monitor crashes so the container gets restarted"""
+    if task.cancelled() or task.exception() is None:
+        return
+    logger.error(f"Monitoring service crashed: {task.exception()}")
+    signal.raise_signal(signal.SIGTERM)
+
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Shelly Starlink Control API",
     description="API to control Shelly plug operation modes",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add rate limiter to app
@@ -106,6 +151,7 @@ async def get_modes() -> ModesResponse:
 
 @app.get("/control", response_model=ControlResponse)
 async def control_mode(
+    request: Request,
     mode: ControlMode,
     token: str,
 ) -> ControlResponse:
@@ -123,7 +169,7 @@ async def control_mode(
 
     try:
         # Set the mode
-        success = controller.set_mode(mode)
+        success = await controller.set_mode(request.app.state.shelly_session, mode)
 
         if success:
             logger.info(f"Mode changed to: {mode.value}")
@@ -159,7 +205,7 @@ async def get_status(request: Request) -> dict:
         Current mode, plug state, and monitoring status
     """
     try:
-        status = controller.get_status()
+        status = await controller.get_status(request.app.state.shelly_session)
         return status
     except Exception as e:
         logger.error(f"Error getting status: {e}")
@@ -1,15 +1,15 @@
+import asyncio
 import logging
 import os
 import signal
+import time
 from datetime import datetime
-from threading import Event
+from typing import Optional
 
-import requests
-from urllib3.exceptions import InsecureRequestWarning
+import aiohttp
 
-from .shelly_controller import ShellyController, ControlMode
-
-requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+from .retry import request_with_retry
+from .shelly_controller import REQUEST_TIMEOUT, ShellyController, ControlMode, create_shelly_session
 
 logging.basicConfig(
     level=logging.INFO,
@@ -28,134 +28,332 @@ CHECK_INTERVAL = int(os.getenv('CHECK_INTERVAL', '10'))
 FAILURE_THRESHOLD = int(os.getenv('FAILURE_THRESHOLD', '3'))
 RECOVERY_DELAY = int(os.getenv('RECOVERY_DELAY', '600'))
 
-shutdown_event = Event()
-controller = ShellyController()
+LOGIN_URL = f'{OMADA_URL}/api/v2/login'
+# Filled in with the omadacId returned by login
+GATEWAY_URL_TEMPLATE = f'{OMADA_URL}/{{omadac_id}}/api/v2/sites/{SITE_ID}/gateways/{GATEWAY_MAC}'
 
+# Omada login is reused until it expires or the controller rejects the token
+LOGIN_TTL = 20 * 60
+AUTH_ERROR_CODES = {-44112}
 
-def check_wan1_status():
-    """Check WAN1 internet status from Omada controller"""
+# State stores the raw mode string; compare against it without building an Enum
+AUTO_MODE = ControlMode.AUTO.value
+
+BOOT_ID_FILE = '/proc/sys/kernel/random/boot_id'
+
+_auth = {'omadac_id': None, 'gateway_url': None, 'token': None, 'expires_at': 0}
+_last_stats = {'online_detection': None}
+
+
+def _read_boot_id() -> Optional[str]:
+    """Read the kernel boot id, or None where it is unavailable"""
     try:
-        session = requests.Session()
-        login = session.post(
-            f'{OMADA_URL}/api/v2/login',
-            json={'username': USERNAME, 'password': PASSWORD},
-            verify=False,
-            timeout=5
-        ).json()
-
-        if login.get('errorCode') == 0:
-            result = login.get('result', {})
-            omadac_id = result.get('omadacId')
-            token = result.get('token')
-
-            if not omadac_id or not token:
-                logger.error('Missing omadacId or token in login response')
-                return False
-
-            gateway = session.get(
-                f'{OMADA_URL}/{omadac_id}/api/v2/sites/{SITE_ID}/gateways/{GATEWAY_MAC}',
-                headers={'Csrf-Token': token},
-                verify=False,
-                timeout=5
-            ).json()
-
-            if gateway.get('errorCode') == 0:
-                result = gateway.get('result', {})
-                port_stats = result.get('portStats', [])
-                for port in port_stats:
-                    if port.get('type') == 0 and port.get('port') == 1:
-                        internet_state = port.get('internetState')
-                        online_detection = port.get('onlineDetection')
-                        status = port.get('status')
-                        ip = port.get('ip')
-                        logger.info(f"WAN1 Stats - InternetState: {internet_state}, OnlineDetection: {online_detection}, Status: {status}, IP: {ip}")
-                        return port.get('onlineDetection') == 1
+        with open(BOOT_ID_FILE, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+BOOT_ID = _read_boot_id()
+
+
+def create_omada_session() -> aiohttp.ClientSession:
+    """
+    Create a keep-alive session for the Omada controller.
+
+    The controller uses a self-signed certificate and is usually addressed by
+    IP, so TLS verification is disabled and the cookie jar accepts IP hosts.
+    """
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=8, keepalive_timeout=120, ssl=False),
+        cookie_jar=aiohttp.CookieJar(unsafe=True),
+        timeout=REQUEST_TIMEOUT
+    )
+
 
+def _clear_login() -> None:
+    """Forget the cached Omada login"""
+    _auth['omadac_id'] = None
+    _auth['gateway_url'] = None
+    _auth['token'] = None
+    _auth['expires_at'] = 0
+
+
+async def _ensure_login(session: aiohttp.ClientSession) -> bool:
+    """
+    Log in to the Omada controller unless a cached login is still valid.
+
+    Args:
+        session: Session used for Omada requests
+
+    Returns:
+        True if a usable omadacId and token are cached, False otherwise
+    """
+    if _auth['token'] and time.monotonic() < _auth['expires_at']:
+        return True
+
+    _clear_login()
+    async with request_with_retry(
+        session,
+        'POST',
+        LOGIN_URL,
+        json={'username': USERNAME, 'password': PASSWORD}
+    ) as response:
+        login = await response.json(content_type=None)
+
+    if login.get('errorCode') != 0:
+        logger.error(f"Omada login failed: {login.get('msg')}")
         return False
+
+    result = login.get('result', {})
+    omadac_id = result.get('omadacId')
+    token = result.get('token')
+
+    if not omadac_id or not token:
+        logger.error('Missing omadacId or token in login response')
+        return False
+
+    _auth['omadac_id'] = omadac_id
+    _auth['gateway_url'] = GATEWAY_URL_TEMPLATE.format(omadac_id=omadac_id)
+    _auth['token'] = token
+    _auth['expires_at'] = time.monotonic() + LOGIN_TTL
+    return True
+
+
+async def _fetch_gateway(session: aiohttp.ClientSession) -> Optional[dict]:
+    """
+    Fetch gateway details, logging in again once if the cached token expired.
+
+    Args:
+        session: Session used for Omada requests
+
+    Returns:
+        Gateway result payload, or None on failure
+    """
+    for _ in range(2):
+        if not await _ensure_login(session):
+            return None
+
+        async with request_with_retry(
+            session,
+            'GET',
+            _auth['gateway_url'],
+            headers={'Csrf-Token': _auth['token']}
+        ) as response:
+            if response.status == 401:
+                _clear_login()
+                continue
+            gateway = await response.json(content_type=None)
+
+        error_code = gateway.get('errorCode')
+        if error_code == 0:
+            return gateway.get('result', {})
+        if error_code in AUTH_ERROR_CODES:
+            _clear_login()
+            continue
+
+        logger.error(f"Failed to get gateway status: {gateway.get('msg')}")
+        return None
+
+    return None
+
+
+async def check_wan1_status(session: aiohttp.ClientSession) -> bool:
+    """Check WAN1 internet status from Omada controller"""
+    try:
+        result = await _fetch_gateway(session)
+        if result is None:
+            return False
+
+        port_stats = result.get('portStats', [])
+        port = next((p for p in port_stats if p.get('type') == 0 and p.get('port') == 1), None)
+        if port is None:
+            return False
+
+        internet_state = port.get('internetState')
+        online_detection = port.get('onlineDetection')
+        status = port.get('status')
+        ip = port.get('ip')
+        # Identical stats repeat every tick; only surface them at INFO on change
+        level = logging.INFO if online_detection != _last_stats['online_detection'] else logging.DEBUG
+        _last_stats['online_detection'] = online_detection
+        logger.log(
+            level,
+            'WAN1 Stats - InternetState: %s, OnlineDetection: %s, Status: %s, IP: %s',
+            internet_state, online_detection, status, ip
+        )
+        return online_detection == 1
     except Exception as e:
         logger.error(f'Error checking WAN1: {e}')
         return False
 
 
-def signal_handler(signum, frame):
-    """Handle shutdown signals"""
-    logger.info('Shutdown signal received')
-    shutdown_event.set()
+async def _wait(stop_event: asyncio.Event, timeout: float) -> None:
+    """Sleep for timeout seconds, waking early if stop_event is set"""
+    try:
+        await asyncio.wait_for(stop_event.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def _apply_check(
+    controller: ShellyController,
+    shelly_session: aiohttp.ClientSession,
+    wan1_online: bool
+) -> None:
+    """
+    Act on a WAN1 check result and record it in state.
+
+    Must be called with controller.state_lock held so a mode change made
+    through the API cannot interleave with the plug switch and write-back.
+
+    Args:
+        controller: Controller holding the state shared with the API
+        shelly_session: Session used for Shelly requests
+        wan1_online: Result of the WAN1 check
+    """
+    state = controller.load_state()
+    current_mode = state.get('mode', AUTO_MODE)
+
+    # The mode may have changed through the API while the check was running
+    if current_mode != AUTO_MODE:
+        logger.debug('Mode changed to %s during check, discarding result', current_mode)
+        return
+
+    failures = state.get('consecutive_failures', 0)
+    plug_on = state.get('plug_on', False)
+    last_online_mono = state.get('last_wan1_online_mono')
+    last_online_time = state.get('last_wan1_online_time')
+    initial = (failures, plug_on, last_online_mono, last_online_time)
+
+    if wan1_online:
+        # Logged on every healthy tick, so keep it out of INFO
+        logger.debug('WAN1: ONLINE')
+        failures = 0
+
+        if plug_on:
+            if last_online_mono is None:
+                last_online_mono = time.monotonic()
+                # Wall-clock copy is kept for display only
+                last_online_time = datetime.now().isoformat()
+                logger.info('WAN1 back online. Starting recovery timer.')
+
+            time_online = time.monotonic() - last_online_mono
+
+            if time_online >= RECOVERY_DELAY:
+                logger.info('WAN1 online for %.0fs. Turning plug OFF.', time_online)
+                if await controller.control_plug(shelly_session, False):
+                    plug_on = False
+                    last_online_mono = None
+                    last_online_time = None
+            elif logger.isEnabledFor(logging.INFO):
+                wait_time = RECOVERY_DELAY - time_online
+                logger.info('WAN1 online for %.0fs. Waiting %.0fs more before turning plug OFF.', time_online, wait_time)
+    else:
+        logger.info('WAN1: OFFLINE')
+        failures += 1
+        logger.warning('Consecutive failures: %d/%d', failures, FAILURE_THRESHOLD)
+
+        if failures >= FAILURE_THRESHOLD:
+            if not plug_on:
+                logger.warning('WAN1 failed %d times. Turning plug ON.', FAILURE_THRESHOLD)
+                if await controller.control_plug(shelly_session, True):
+                    plug_on = True
+                    last_online_mono = None
+                    last_online_time = None
+            else:
+                logger.debug('Plug already ON, no action needed.')
+
+    # Steady-state ticks (e.g. waiting out RECOVERY_DELAY) change nothing
+    if (failures, plug_on, last_online_mono, last_online_time) != initial:
+        state.update({
+            'consecutive_failures': failures,
+            'plug_on': plug_on,
+            'last_wan1_online_mono': last_online_mono,
+            'last_wan1_online_time': last_online_time
+        })
+        controller.save_state(state)
 
 
-def main():
-    """Main monitoring loop"""
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
-
+async def monitor_loop(
+    controller: ShellyController,
+    shelly_session: aiohttp.ClientSession,
+    omada_session: aiohttp.ClientSession,
+    stop_event: asyncio.Event
+) -> None:
+    """
+    Main monitoring loop.
+
+    Args:
+        controller: Controller holding the state shared with the API
+        shelly_session: Session used for Shelly requests
+        omada_session: Session used for Omada requests
+        stop_event: Set to stop the loop after the current check
+    """
     logger.info('Starting WAN1 monitoring service...')
 
     # Initialize state with current plug status
-    state = controller.load_state()
-    current_plug_state = controller.get_plug_status()
-    if current_plug_state is not None:
-        state['plug_on'] = current_plug_state
+    async with controller.state_lock:
+        state = controller.load_state()
+
+        # Monotonic clock restarts on reboot, so a timestamp saved under another
+        # boot is meaningless. Without a boot id (non-Linux) only a timestamp
+        # from the future can be detected as stale.
+        last_online_mono = state.get('last_wan1_online_mono')
+        if last_online_mono is not None and (
+            state.get('boot_id') != BOOT_ID or last_online_mono > time.monotonic()
+        ):
+            state['last_wan1_online_mono'] = None
+            state['last_wan1_online_time'] = None
+        state['boot_id'] = BOOT_ID
+
+        current_plug_state = await controller.get_plug_status(shelly_session)
+        if current_plug_state is not None:
+            state['plug_on'] = current_plug_state
         controller.save_state(state)
 
-    while not shutdown_event.is_set():
+    while not stop_event.is_set():
         try:
-            state = controller.load_state()
-            current_mode = ControlMode(state.get('mode', ControlMode.AUTO.value))
+            current_mode = controller.load_state().get('mode', AUTO_MODE)
 
             # Only run automatic monitoring if in AUTO mode
-            if current_mode != ControlMode.AUTO:
-                logger.debug(f'Mode is {current_mode.value}, skipping automatic monitoring')
-                shutdown_event.wait(CHECK_INTERVAL)
+            if current_mode != AUTO_MODE:
+                logger.debug('Mode is %s, skipping automatic monitoring', current_mode)
+                await _wait(stop_event, CHECK_INTERVAL)
                 continue
 
-            wan1_online = check_wan1_status()
+            # The Omada check runs unlocked so the API stays responsive; the
+            # decision and plug switch are serialized with set_mode
+            wan1_online = await check_wan1_status(omada_session)
+            async with controller.state_lock:
+                await _apply_check(controller, shelly_session, wan1_online)
 
-            status = 'ONLINE' if wan1_online else 'OFFLINE'
-            logger.info(f'WAN1: {status}')
+            await _wait(stop_event, CHECK_INTERVAL)
 
-            if wan1_online:
-                state['consecutive_failures'] = 0
+        except Exception as e:
+            logger.error(f'Error: {e}')
+            await _wait(stop_event, CHECK_INTERVAL)
 
-                if state.get('plug_on', False):
-                    if state.get('last_wan1_online_time') is None:
-                        state['last_wan1_online_time'] = datetime.now().isoformat()
-                        logger.info('WAN1 back online. Starting recovery timer.')
+    logger.info('Service stopped gracefully')
 
-                    last_online_time = state.get('last_wan1_online_time')
-                    if last_online_time:
-                        last_online = datetime.fromisoformat(last_online_time)
-                        time_online = (datetime.now() - last_online).total_seconds()
 
-                        if time_online >= RECOVERY_DELAY:
-                            logger.info(f'WAN1 online for {time_online:.0f}s. Turning plug OFF.')
-                            if controller.control_plug(False):
-                                state['plug_on'] = False
-                                state['last_wan1_online_time'] = None
-                        else:
-                            wait_time = RECOVERY_DELAY - time_online
-                            logger.info(f'WAN1 online for {time_online:.0f}s. Waiting {wait_time:.0f}s more before turning plug OFF.')
-            else:
-                state['consecutive_failures'] = state.get('consecutive_failures', 0) + 1
-                failures = state.get('consecutive_failures', 0)
-                logger.warning(f'Consecutive failures: {failures}/{FAILURE_THRESHOLD}')
-
-                if state.get('consecutive_failures', 0) >= FAILURE_THRESHOLD:
-                    if not state.get('plug_on', False):
-                        logger.warning(f'WAN1 failed {FAILURE_THRESHOLD} times. Turning plug ON.')
-                        if controller.control_plug(True):
-                            state['plug_on'] = True
-                            state['last_wan1_online_time'] = None
-                    else:
-                        logger.debug('Plug already ON, no action needed.')
-
-            controller.save_state(state)
-            shutdown_event.wait(CHECK_INTERVAL)
+async def _run_standalone() -> None:
+    """Run the monitor without the API until SIGINT/SIGTERM"""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    # Loop signal handlers run as ordinary callbacks between awaits, never
+    # in the middle of a request or state write
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop_event.set)
 
-        except Exception as e:
-            logger.error(f'Error: {e}')
-            shutdown_event.wait(CHECK_INTERVAL)
+    controller = ShellyController()
+    async with create_shelly_session() as shelly_session, create_omada_session() as omada_session:
+        await monitor_loop(controller, shelly_session, omada_session, stop_event)
 
-    logger.info('Service stopped gracefully')
+
+def main():
+    """Run the monitoring service on its own"""
+    asyncio.run(_run_standalone())
 
 
 if __name__ == '__main__':
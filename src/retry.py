@@ -0,0 +1,54 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# Retry transient failures within a single check instead of waiting a full
+# CHECK_INTERVAL (mirrors urllib3 Retry(total=2, backoff_factor=0.3))
+RETRY_TOTAL = 2
+RETRY_BACKOFF = 0.3
+RETRY_STATUSES = {502, 503, 504}
+
+
+@asynccontextmanager
+async def request_with_retry(
+    session: aiohttp.ClientSession,
+    method: str,
+    url: str,
+    **kwargs
+) -> AsyncIterator[aiohttp.ClientResponse]:
+    """
+    Send a request, retrying connection errors, timeouts and 502/503/504.
+
+    Args:
+        session: aiohttp session used for the request
+        method: HTTP method
+        url: Request URL
+        **kwargs: Passed through to session.request
+
+    Yields:
+        The final response
+    """
+    for attempt in range(RETRY_TOTAL + 1):
+        is_last = attempt == RETRY_TOTAL
+        try:
+            response = await session.request(method, url, **kwargs)
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            if is_last:
+                raise
+            logger.warning(f'Retrying {method} {url} after error: {type(e).__name__}: {e}')
+        else:
+            if is_last or response.status not in RETRY_STATUSES:
+                try:
+                    yield response
+                finally:
+                    response.release()
+                return
+            response.release()
+            logger.warning(f'Retrying {method} {url} after status {response.status}')
+
+        await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
@@ -1,14 +1,47 @@
+import asyncio
 import json
 import logging
 import os
 from enum import Enum
 from typing import Optional
 
-import requests
+import aiohttp
+
+from .retry import request_with_retry
+
+try:
+    import orjson
+except ImportError:  # Fall back to stdlib json where no orjson wheel exists
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
 
+def _dumps(data: dict) -> bytes:
+    """Serialize state to compact JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':')).encode()
+
+
+def _loads(data: bytes) -> dict:
+    """Deserialize state from JSON bytes"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=5)
+
+
+def create_shelly_session() -> aiohttp.ClientSession:
+    """Create a keep-alive session for the Shelly plug"""
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=8, keepalive_timeout=120),
+        timeout=REQUEST_TIMEOUT
+    )
+
+
 class ControlMode(str, Enum):
     """Control modes for Shelly plug"""
     ON = "on"
@@ -19,7 +52,7 @@ class ControlMode(str, Enum):
 class ShellyController:
     """Controller for managing Shelly plug state and modes"""
 
-    STATE_FILE = '/app/state.json'
+    STATE_FILE = '/app/data/state.json'
 
     def __init__(self):
         """Initialize the Shelly controller"""
@@ -27,35 +60,67 @@ class ShellyController:
         if not self.shelly_base_url:
             raise ValueError('SHELLY_BASE_URL environment variable must be set')
 
-    def load_state(self) -> dict:
-        """Load state from JSON file"""
+        # In-memory state shared by the API and monitor task, written to
+        # STATE_FILE only when it changes
+        self._state = None
+        self._dirty = False
+
+        # Serializes mode changes with the monitor's decide-switch-save step
+        self.state_lock = asyncio.Lock()
+
+    def _read_state_file(self) -> dict:
+        """
+        Read state from JSON file.
+
+        Writes are atomic, so a file that fails to parse is genuinely corrupt
+        and the error is raised instead of silently resetting to defaults.
+        """
         if os.path.exists(self.STATE_FILE):
-            try:
-                with open(self.STATE_FILE, 'r') as f:
-                    return json.load(f)
-            except Exception as e:
-                logger.error(f'Error loading state: {e}')
+            with open(self.STATE_FILE, 'rb') as f:
+                return _loads(f.read())
 
         return {
             'consecutive_failures': 0,
             'plug_on': False,
+            'last_wan1_online_mono': None,
             'last_wan1_online_time': None,
+            'boot_id': None,
             'mode': ControlMode.AUTO.value
         }
 
+    def load_state(self) -> dict:
+        """Load state, reading the JSON file only on first access"""
+        if self._state is None:
+            self._state = self._read_state_file()
+        return self._state.copy()
+
     def save_state(self, state: dict) -> None:
-        """Save state to JSON file"""
+        """Replace cached state and persist it to disk if it changed"""
+        if self._state != state:
+            self._state = dict(state)
+            self._dirty = True
+        if not self._dirty:
+            return
+
         try:
-            with open(self.STATE_FILE, 'w') as f:
-                json.dump(state, f, indent=2)
+            # Write to a sibling file and rename so readers never see a partial file
+            data = _dumps(self._state)
+            tmp_file = f'{self.STATE_FILE}.tmp'
+            with open(tmp_file, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self.STATE_FILE)
+            self._dirty = False
         except Exception as e:
             logger.error(f'Error saving state: {e}')
 
-    def control_plug(self, turn_on: bool) -> bool:
+    async def control_plug(self, session: aiohttp.ClientSession, turn_on: bool) -> bool:
         """
         Control Shelly plug on/off state.
 
         Args:
+            session: aiohttp session used for the request
             turn_on: True to turn on, False to turn off
 
         Returns:
@@ -63,105 +128,116 @@ class ShellyController:
         """
         try:
             payload = {'id': 0, 'on': turn_on}
-            response = requests.post(
+            async with request_with_retry(
+                session,
+                'POST',
                 f'{self.shelly_base_url}/rpc/Switch.Set',
-                json=payload,
-                timeout=5
-            )
-            if response.status_code == 200:
-                state_str = 'ON' if turn_on else 'OFF'
-                logger.info(f'Shelly plug turned {state_str}')
-                return True
-            else:
-                logger.warning(f'Failed to control plug: {response.status_code}')
-                return False
+                json=payload
+            ) as response:
+                if response.status == 200:
+                    state_str = 'ON' if turn_on else 'OFF'
+                    logger.info(f'Shelly plug turned {state_str}')
+                    return True
+                else:
+                    logger.warning(f'Failed to control plug: {response.status}')
+                    return False
         except Exception as e:
             logger.error(f'Error controlling Shelly plug: {e}')
             return False
 
-    def get_plug_status(self) -> Optional[bool]:
+    async def get_plug_status(self, session: aiohttp.ClientSession) -> Optional[bool]:
         """
         Get current Shelly plug status.
 
+        Args:
+            session: aiohttp session used for the request
+
         Returns:
             True if on, False if off, None if error
         """
         try:
-            response = requests.post(
+            async with request_with_retry(
+                session,
+                'POST',
                 f'{self.shelly_base_url}/rpc/Switch.GetStatus',
-                json={'id': 0},
-                timeout=5
-            )
-            if response.status_code == 200:
-                result = response.json()
-                is_on = result.get('output', False)
-                return is_on
-            else:
-                logger.warning(f'Failed to get plug status: {response.status_code}')
-                return None
+                json={'id': 0}
+            ) as response:
+                if response.status == 200:
+                    result = await response.json(content_type=None)
+                    is_on = result.get('output', False)
+                    return is_on
+                else:
+                    logger.warning(f'Failed to get plug status: {response.status}')
+                    return None
         except Exception as e:
             logger.error(f'Error getting Shelly plug status: {e}')
             return None
 
-    def set_mode(self, mode: ControlMode) -> bool:
+    async def set_mode(self, session: aiohttp.ClientSession, mode: ControlMode) -> bool:
         """
         Set the operating mode and apply it.
 
         Args:
+            session: aiohttp session used for Shelly requests
             mode: The control mode to set
 
         Returns:
             True if successful, False otherwise
         """
         try:
-            state = self.load_state()
-            old_mode = state.get('mode', ControlMode.AUTO.value)
-            state['mode'] = mode.value
-
-            # Apply the mode immediately
-            if mode == ControlMode.ON:
-                # Turn plug ON and update state
-                if self.control_plug(True):
-                    state['plug_on'] = True
-                    state['consecutive_failures'] = 0
-                    state['last_wan1_online_time'] = None
+            async with self.state_lock:
+                state = self.load_state()
+                old_mode = state.get('mode', ControlMode.AUTO.value)
+                new_mode = mode.value
+                plug_on = state.get('plug_on', False)
+
+                # Apply the mode immediately
+                if new_mode == 'on':
+                    # Turn plug ON
+                    if not await self.control_plug(session, True):
+                        return False
+                    plug_on = True
                     logger.info(f'Mode changed from {old_mode} to ON - plug turned ON')
-                else:
-                    return False
 
-            elif mode == ControlMode.OFF:
-                # Turn plug OFF and update state
-                if self.control_plug(False):
-                    state['plug_on'] = False
-                    state['consecutive_failures'] = 0
-                    state['last_wan1_online_time'] = None
+                elif new_mode == 'off':
+                    # Turn plug OFF
+                    if not await self.control_plug(session, False):
+                        return False
+                    plug_on = False
                     logger.info(f'Mode changed from {old_mode} to OFF - plug turned OFF')
-                else:
-                    return False
 
-            elif mode == ControlMode.AUTO:
-                # Reset to auto mode - don't change plug state
-                # Let the monitoring service handle it
-                state['consecutive_failures'] = 0
-                state['last_wan1_online_time'] = None
-                logger.info(f'Mode changed from {old_mode} to AUTO - monitoring service will control plug')
-
-            self.save_state(state)
-            return True
+                elif new_mode == 'auto':
+                    # Reset to auto mode - don't change plug state
+                    # Let the monitoring service handle it
+                    logger.info(f'Mode changed from {old_mode} to AUTO - monitoring service will control plug')
+
+                # Every mode change resets failure tracking and the recovery timer
+                state.update({
+                    'mode': new_mode,
+                    'plug_on': plug_on,
+                    'consecutive_failures': 0,
+                    'last_wan1_online_mono': None,
+                    'last_wan1_online_time': None
+                })
+                self.save_state(state)
+                return True
 
         except Exception as e:
             logger.error(f'Error setting mode: {e}')
             return False
 
-    def get_status(self) -> dict:
+    async def get_status(self, session: aiohttp.ClientSession) -> dict:
         """
         Get current system status.
 
+        Args:
+            session: aiohttp session used for Shelly requests
+
         Returns:
             Dictionary with current mode, plug state, and monitoring info
         """
         state = self.load_state()
-        plug_status = self.get_plug_status()
+        plug_status = await self.get_plug_status(session)
 
         return {
             'mode': state.get('mode', ControlMode.AUTO.value),